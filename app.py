@@ -2,13 +2,17 @@
 Clean Flask Application for Attendance Management System
 Focuses on backend logic, routing, and business operations
 """
-import sys
-# Prevent Python from generating .pyc files and __pycache__ folders
-sys.dont_write_bytecode = True
-
-from flask import Flask, request, redirect, jsonify
-import gc
+from flask import Flask, request, redirect
+import functools
+import io
+import logging
+import os
+import re
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from flask_cors import CORS
+from werkzeug.exceptions import HTTPException
 
 # Import our modules
 from backend.config import Config
@@ -16,6 +20,10 @@ from backend.models import db, init_db
 from backend.services.attendance_service import AttendanceService
 from backend.utils.excel_processor import ExcelProcessor
 from backend.utils.export_utils import ExportUtils
+from backend.utils.json_response import json_response
+
+# Upload summaries log at INFO; set LOG_LEVEL=DEBUG to see every added/updated/skipped record
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
 
 def create_app():
     """Application factory pattern"""
@@ -62,10 +70,16 @@ excel_processor = ExcelProcessor()
 attendance_service = AttendanceService()
 export_utils = ExportUtils()
 
+# Uploaded files are parsed in parallel, but database writes are serialized.
+# This lock only covers threads of one process; across gunicorn workers every write
+# transaction starts with lock_attendance_summary() so the summary counts stay complete.
+db_write_lock = threading.Lock()
+
+ALLOWED_FILE_RE = re.compile(r'.*\.(?:xlsx|xls|csv)', re.IGNORECASE)
+
 def allowed_file(filename):
     """Check if uploaded file has valid extension"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in {'xlsx', 'xls', 'csv'}
+    return bool(ALLOWED_FILE_RE.fullmatch(filename or ''))
 
 @app.route('/')
 def dashboard():
@@ -86,102 +100,167 @@ def upload_file():
     
     # Handle POST request (multiple file upload)
     if 'files' not in request.files:
-        return jsonify({ 'success': False, 'error': 'No files selected' }), 400
+        return json_response({ 'success': False, 'error': 'No files selected' }, 400)
     
     files = request.files.getlist('files')
     if not files or len(files) == 0 or (len(files) == 1 and files[0].filename == ''):
-        return jsonify({ 'success': False, 'error': 'No files selected' }), 400
+        return json_response({ 'success': False, 'error': 'No files selected' }, 400)
     
-    # Allow up to 20 files per request (processed sequentially to control memory)
+    # Allow up to 20 files per request (parsed in parallel, saved one at a time in upload order)
     if len(files) > 20:
-        return jsonify({ 'success': False, 'error': 'Maximum 20 files allowed at once' }), 400
+        return json_response({ 'success': False, 'error': 'Maximum 20 files allowed at once' }, 400)
 
     processed_files = 0
     errors = []
     
     try:
-        # Process each file directly from memory
+        # Read each valid file into memory in the request thread
+        payloads = []
         for file in files:
             if not file or not allowed_file(file.filename):
                 errors.append(f"Invalid file type: {file.filename}")
                 continue
-            
-            # Process the file based on its type
-            if file.filename.lower().endswith(('.xlsx', '.xls', '.csv')):
-                success = process_excel_file_from_memory(file)
-                if success:
-                    processed_files += 1
-                else:
-                    errors.append(f"Failed to process: {file.filename}")
-            # Try to free memory between files
+            payloads.append((file.filename, file.stream.read()))
             try:
                 file.stream.close()
             except Exception:
                 pass
-            try:
-                gc.collect()
-            except Exception:
-                pass
-            else:
-                errors.append(f"Unsupported file format: {file.filename}")
+        
+        # Files are independent, so parse them concurrently; saves run here in upload order,
+        # which decides the winner when two files have the same conducted periods
+        if payloads:
+            max_workers = min(len(payloads), (os.cpu_count() or 1) * 2)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                parsed = executor.map(lambda payload: parse_excel_file_from_memory(*payload), payloads)
+                for (filename, _), processed_data in zip(payloads, parsed):
+                    if save_processed_data(processed_data):
+                        processed_files += 1
+                    else:
+                        errors.append(f"Failed to process: {filename}")
+            
+            # New data invalidates the cached course list and stats
+            attendance_service.invalidate_cache()
+        
+        # Release the upload buffers; refcounting frees them immediately
+        del payloads
         
         if processed_files > 0:
             message = f"Successfully processed {processed_files} file(s)."
             if errors:
                 message += f" {len(errors)} file(s) had errors."
-            return jsonify({ 'success': True, 'message': message })
+            return json_response({ 'success': True, 'message': message })
         else:
             error_msg = "No files were processed successfully."
             if errors:
                 error_msg += f" Errors: {'; '.join(errors[:3])}"  # Show first 3 errors
-            return jsonify({ 'success': False, 'error': error_msg }), 500
+            return json_response({ 'success': False, 'error': error_msg }, 500)
             
+    except HTTPException:
+        # e.g. RequestEntityTooLarge: keep its status code (413) instead of a generic 500
+        raise
     except Exception as e:
         print(f"Error processing uploads: {e}")
-        return jsonify({ 'success': False, 'error': 'An error occurred while processing the files.' }), 500
-
-def process_excel_file_from_memory(file):
-    """Process Excel file directly from memory and save to database"""
+        return json_response({ 'success': False, 'error': 'An error occurred while processing the files.' }, 500)
+
+@app.route('/upload_stream', methods=['POST'])
+def upload_stream():
+    """Handle a single file sent as the raw request body (name in ?filename=)"""
+    filename = request.args.get('filename', '')
+    if not allowed_file(filename):
+        return json_response({ 'success': False, 'error': f"Invalid file type: {filename}" }, 400)
+    
     try:
-        # Process Excel file directly from uploaded file object
-        processed_data = excel_processor.process_excel_file_from_memory(file)
+        # Copy the body in large chunks instead of going through the multipart parser
+        buffer = io.BytesIO()
+        shutil.copyfileobj(request.stream, buffer, length=65536)
+        if buffer.tell() == 0:
+            return json_response({ 'success': False, 'error': 'No files selected' }, 400)
         
-        if processed_data:
-            # Save to database
-            return excel_processor.save_to_database(processed_data)
-        return False
+        # Parse straight from the buffer; getvalue() would copy the whole upload
+        buffer.seek(0)
+        success = process_excel_file_from_memory(filename, buffer)
+        del buffer
+        
+        # New data invalidates the cached course list and stats
+        attendance_service.invalidate_cache()
+        
+        if success:
+            return json_response({ 'success': True, 'message': 'Successfully processed 1 file(s).' })
+        return json_response({ 'success': False, 'error': f"Failed to process: {filename}" }, 500)
         
+    except HTTPException:
+        # e.g. RequestEntityTooLarge: keep its status code (413) instead of a generic 500
+        raise
+    except Exception as e:
+        print(f"Error processing upload stream: {e}")
+        return json_response({ 'success': False, 'error': 'An error occurred while processing the file.' }, 500)
+
+def parse_excel_file_from_memory(filename, content):
+    """Parse uploaded Excel/CSV bytes (or an in-memory buffer); safe to run in a worker thread"""
+    try:
+        return excel_processor.process_excel_file_from_memory(filename, content)
     except Exception as e:
         print(f"Error processing Excel file: {e}")
+        return None
+
+def save_processed_data(processed_data):
+    """Save parsed file data to the database (request thread, app context already active)"""
+    if not processed_data:
         return False
+    # Uploads on other request threads wait here, so writes run one at a time
+    with db_write_lock:
+        return excel_processor.save_to_database(processed_data)
+
+def process_excel_file_from_memory(filename, content):
+    """Process uploaded Excel/CSV bytes (or an in-memory buffer) and save to database"""
+    return save_processed_data(parse_excel_file_from_memory(filename, content))
 
 @app.route('/api/attendance')
 def api_attendance():
-    """API endpoint for filtered attendance data"""
+    """API endpoint for filtered attendance data (paginated when `page` is given)"""
     course_code = request.args.get('course', '')
     threshold = float(request.args.get('threshold', 75))
     search = request.args.get('search', '')
     exclude_courses_str = request.args.get('exclude_courses', '')
+    # Zero-based page; without it the full list is returned as before
+    page = request.args.get('page', type=int)
+    page_size = request.args.get('page_size', 100, type=int)
     
     # Parse excluded courses (comma-separated)
     exclude_courses = [c.strip() for c in exclude_courses_str.split(',') if c.strip()] if exclude_courses_str else None
     
-    # Get filtered records
-    records = attendance_service.get_filtered_attendance_records(
-        course_code=course_code, 
-        threshold=threshold, 
-        search=search,
-        exclude_courses=exclude_courses
-    )
+    filters = {
+        'course_code': course_code,
+        'threshold': threshold,
+        'search': search,
+        'exclude_courses': exclude_courses
+    }
     
-    # Format for JSON response
-    data = attendance_service.format_attendance_data_for_export(records)
-    return jsonify(data)
+    if page is None:
+        # Get filtered rows as plain tuples (no ORM objects)
+        rows = attendance_service.get_filtered_attendance_rows(**filters)
+        
+        # Format for JSON response
+        data = attendance_service.format_attendance_data_for_export(rows)
+        return json_response(data)
+    
+    page = max(page, 0)
+    page_size = min(max(page_size, 1), 1000)
+    rows = attendance_service.get_filtered_attendance_rows(
+        **filters, limit=page_size, offset=page * page_size
+    )
+    data = attendance_service.format_attendance_data_for_export(rows, start=page * page_size + 1)
+    return json_response({
+        'total': attendance_service.count_filtered_attendance(**filters),
+        'page': page,
+        'page_size': page_size,
+        'rows': data
+    })
 
 @app.route('/api/stats')
 def api_stats():
     """API endpoint for dashboard statistics (overall)"""
-    return jsonify(attendance_service.calculate_dashboard_stats())
+    return json_response(attendance_service.calculate_dashboard_stats())
 
 @app.route('/api/filtered_stats')
 def api_filtered_stats():
@@ -194,7 +273,7 @@ def api_filtered_stats():
     # Parse excluded courses (comma-separated)
     exclude_courses = [c.strip() for c in exclude_courses_str.split(',') if c.strip()] if exclude_courses_str else None
     
-    return jsonify(attendance_service.calculate_filtered_stats(
+    return json_response(attendance_service.calculate_filtered_stats(
         course_code=course_code, 
         threshold=threshold, 
         search=search,
@@ -205,91 +284,54 @@ def api_filtered_stats():
 def api_courses():
     """API endpoint for course list"""
     courses = attendance_service.get_all_courses()
-    return jsonify([{'code': c.course_code, 'name': c.course_name} for c in courses])
+    return json_response([{'code': c.course_code, 'name': c.course_name} for c in courses])
+
+def export_filter_args():
+    """Read the filter query args shared by the export routes"""
+    exclude_courses = request.args.get('exclude_courses', '')
+    return {
+        'course_code': request.args.get('course', ''),
+        'threshold': float(request.args.get('threshold', 75)),
+        'search': request.args.get('search', ''),
+        'exclude_courses': [c for c in exclude_courses.split(',') if c] if exclude_courses else []
+    }
+
+def conditional_export(view):
+    """Answer 304 when the client's copy of this export is still current, else build it"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = export_utils.export_etag(attendance_service.get_data_version())
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+        else:
+            response = view(*args, **kwargs)
+        response.set_etag(etag, weak=True)
+        # Revalidate every time: the tag changes as soon as the data does
+        response.cache_control.no_cache = True
+        return response
+    return wrapper
 
 @app.route('/export/excel')
+@conditional_export
 def export_excel():
     """Export attendance data to Excel"""
-    course_code = request.args.get('course', '')
-    threshold = float(request.args.get('threshold', 75))
-    search = request.args.get('search', '')
-    exclude_courses = request.args.get('exclude_courses', '')
-    exclude_courses = [c for c in exclude_courses.split(',') if c] if exclude_courses else []
-
-
-    # Get filtered records
-    # If threshold is 100, ignore threshold filter (export all students)
-    if threshold == 100:
-        # Remove threshold filter, get all students for other filters
-        records = attendance_service.get_filtered_attendance_records(
-            course_code=course_code,
-            threshold=101,  # Use a value above 100 to skip filter
-            search=search,
-            exclude_courses=exclude_courses
-        )
-    else:
-        records = attendance_service.get_filtered_attendance_records(
-            course_code=course_code,
-            threshold=threshold,
-            search=search,
-            exclude_courses=exclude_courses
-        )
-
-
-    # Prepare filter info for Excel
-    filter_info = []
-    if course_code:
-        filter_info.append(f"Course: {course_code}")
-    if threshold < 100:
-        filter_info.append(f"Attendance below: {threshold}%")
-    if search:
-        filter_info.append(f"Search: {search}")
-    # Do not include excluded courses in filter_info/filename
-
-    # Format data for export (exclude id from file exports)
-    data = attendance_service.format_attendance_data_for_file_export(records)
-
-    # Generate Excel file with filter info
+    rows, filter_info = attendance_service.get_export_payload(**export_filter_args())
+    data = attendance_service.format_attendance_data_for_file_export(rows)
     return export_utils.generate_excel_export(data, filter_info=filter_info)
 
 @app.route('/export/pdf')
+@conditional_export
 def export_pdf():
     """Export attendance data to PDF"""
-    course_code = request.args.get('course', '')
-    threshold = float(request.args.get('threshold', 75))
-    search = request.args.get('search', '')
-    exclude_courses = request.args.get('exclude_courses', '')
-    exclude_courses = [c for c in exclude_courses.split(',') if c] if exclude_courses else []
-
-    # Get filtered records
-    if threshold == 100:
-        records = attendance_service.get_filtered_attendance_records(
-            course_code=course_code,
-            threshold=101,
-            search=search,
-            exclude_courses=exclude_courses
-        )
-    else:
-        records = attendance_service.get_filtered_attendance_records(
-            course_code=course_code,
-            threshold=threshold,
-            search=search,
-            exclude_courses=exclude_courses
-        )
-
-
-    # Prepare filter info for PDF
-    filter_info = []
-    if course_code:
-        filter_info.append(f"Course: {course_code}")
-    if threshold < 100:
-        filter_info.append(f"Attendance below: {threshold}%")
-    if search:
-        filter_info.append(f"Search: {search}")
-    # Do not include excluded courses in filter_info/filename
-
-    # Generate PDF file
-    return export_utils.generate_pdf_export(records, filter_info)
+    rows, filter_info = attendance_service.get_export_payload(**export_filter_args())
+    return export_utils.generate_pdf_export(rows, filter_info)
+
+@app.route('/export/pdf_by_course')
+@conditional_export
+def export_pdf_by_course():
+    """Export one PDF per course, bundled as a zip"""
+    jobs, filter_info = attendance_service.get_course_export_payloads(**export_filter_args())
+    return export_utils.generate_pdf_zip_export(jobs, filter_info)
 
 @app.route('/delete_record/<int:record_id>', methods=['DELETE'])
 def delete_record(record_id):
@@ -297,12 +339,12 @@ def delete_record(record_id):
     try:
         success = attendance_service.delete_attendance_record(record_id)
         if success:
-            return jsonify({'success': True, 'message': 'Record deleted successfully'})
+            return json_response({'success': True, 'message': 'Record deleted successfully'})
         else:
-            return jsonify({'success': False, 'message': 'Record not found'}), 404
+            return json_response({'success': False, 'message': 'Record not found'}, 404)
     except Exception as e:
         print(f"Error deleting record {record_id}: {e}")
-        return jsonify({'success': False, 'message': 'Error deleting record'}), 500
+        return json_response({'success': False, 'message': 'Error deleting record'}, 500)
 
 @app.route('/clear_all_data', methods=['POST'])
 def clear_all_data():
@@ -310,24 +352,24 @@ def clear_all_data():
     try:
         success = attendance_service.clear_all_data()
         if success:
-            return jsonify({'success': True, 'message': 'All data cleared successfully'})
+            return json_response({'success': True, 'message': 'All data cleared successfully'})
         else:
-            return jsonify({'success': False, 'message': 'Error clearing data'}), 500
+            return json_response({'success': False, 'message': 'Error clearing data'}, 500)
     except Exception as e:
         print(f"Error clearing all data: {e}")
-        return jsonify({'success': False, 'message': 'Error clearing data'}), 500
+        return json_response({'success': False, 'message': 'Error clearing data'}, 500)
 
 
 @app.errorhandler(404)
 def not_found_error(error):
     """Handle 404 errors"""
-    return jsonify({ 'success': False, 'error': 'Page not found' }), 404
+    return json_response({ 'success': False, 'error': 'Page not found' }, 404)
 
 @app.errorhandler(500)
 def internal_error(error):
     """Handle 500 errors"""
     db.session.rollback()
-    return jsonify({ 'success': False, 'error': 'Internal server error' }), 500
+    return json_response({ 'success': False, 'error': 'Internal server error' }, 500)
 
 if __name__ == '__main__':
     with app.app_context():
@@ -336,4 +378,5 @@ if __name__ == '__main__':
         # print("🚀 Starting Attendance Management System...")
         # print("📱 Access at: http://127.0.0.1:5000")
     
-    app.run(debug=True)
\ No newline at end of file
+    # Debug mode (reloader + debugger) only when explicitly requested
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', threaded=True)
\ No newline at end of file
@@ -12,6 +12,18 @@ class Config:
         SQLALCHEMY_DATABASE_URI = SQLALCHEMY_DATABASE_URI.replace("postgres://", "postgresql://", 1)
     
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Larger compiled-statement cache for the repeated filter queries
+    SQLALCHEMY_ENGINE_OPTIONS = {'query_cache_size': 1200}
+
+    # Connection pool settings only apply to server databases (not SQLite)
+    if not SQLALCHEMY_DATABASE_URI.startswith("sqlite"):
+        SQLALCHEMY_ENGINE_OPTIONS.update({
+            'pool_size': 10,
+            'max_overflow': 20,
+            'pool_pre_ping': True,
+            'pool_recycle': 1800,
+        })
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     DEBUG = False
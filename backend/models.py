@@ -1,4 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, text, select, update, func
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 
 db = SQLAlchemy()
@@ -40,11 +42,15 @@ class AttendanceRecord(db.Model):
     course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), nullable=False)
     attended_periods = db.Column(db.Integer, nullable=False)
     conducted_periods = db.Column(db.Integer, nullable=False)
-    attendance_percentage = db.Column(db.Float, nullable=False)
+    attendance_percentage = db.Column(db.Float, nullable=False, index=True)
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
     
-    # Ensure unique combination of student and course
-    __table_args__ = (db.UniqueConstraint('student_id', 'course_id', name='unique_student_course'),)
+    # Ensure unique combination of student and course; index course + percentage
+    # for the course-filtered threshold queries ordered by percentage
+    __table_args__ = (
+        db.UniqueConstraint('student_id', 'course_id', name='unique_student_course'),
+        db.Index('ix_ar_course_pct', 'course_id', 'attendance_percentage'),
+    )
     
     @property
     def is_below_threshold(self):
@@ -53,10 +59,115 @@ class AttendanceRecord(db.Model):
     def __repr__(self):
         return f'<AttendanceRecord {self.student.name} - {self.course.course_code}: {self.attendance_percentage}%>'
 
+class AttendanceSummary(db.Model):
+    """Single row (id=1) of dashboard counts, refreshed on every write"""
+    __tablename__ = 'attendance_summary'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    total_students = db.Column(db.Integer, nullable=False, default=0)
+    total_courses = db.Column(db.Integer, nullable=False, default=0)
+    low_attendance_count = db.Column(db.Integer, nullable=False, default=0)
+    critical_attendance_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'total_students': self.total_students,
+            'total_courses': self.total_courses,
+            'low_attendance_count': self.low_attendance_count,
+            'critical_attendance_count': self.critical_attendance_count
+        }
+    
+    def __repr__(self):
+        return f'<AttendanceSummary students={self.total_students} courses={self.total_courses}>'
+
+def lock_attendance_summary():
+    """Row-lock the summary (SELECT ... FOR UPDATE) at the start of a write transaction.
+
+    Concurrent writers then queue here instead of at the refresh UPDATE, so each one's
+    refresh runs after the previous writer committed and counts its rows too (under
+    READ COMMITTED a blocked UPDATE keeps its pre-wait snapshot). SQLite ignores FOR
+    UPDATE; it already allows only one writer at a time.
+    """
+    db.session.execute(
+        select(AttendanceSummary.id).where(AttendanceSummary.id == 1).with_for_update()
+    )
+
+def refresh_attendance_summary():
+    """Recompute the summary row in a single UPDATE; the caller commits.
+
+    Call lock_attendance_summary() first in the same transaction.
+    """
+    db.session.execute(
+        update(AttendanceSummary).where(AttendanceSummary.id == 1).values(
+            total_students=select(func.count(Student.id)).scalar_subquery(),
+            total_courses=select(func.count(Course.id)).scalar_subquery(),
+            low_attendance_count=select(func.count(AttendanceRecord.id)).where(
+                AttendanceRecord.attendance_percentage < 75
+            ).scalar_subquery(),
+            critical_attendance_count=select(func.count(AttendanceRecord.id)).where(
+                AttendanceRecord.attendance_percentage < 65
+            ).scalar_subquery(),
+            updated_at=datetime.utcnow()
+        )
+    )
+
+def ensure_attendance_summary():
+    """Create and fill the summary row if it does not exist yet"""
+    if db.session.get(AttendanceSummary, 1) is not None:
+        return
+    try:
+        db.session.add(AttendanceSummary(id=1))
+        db.session.flush()
+        refresh_attendance_summary()
+        db.session.commit()
+    except IntegrityError:
+        # Another worker booting against the same fresh database created it first
+        db.session.rollback()
+        if db.session.get(AttendanceSummary, 1) is None:
+            raise
+
 def init_db(app):
     """Initialize the database with the Flask app"""
     db.init_app(app)
     
     with app.app_context():
+        if db.engine.url.get_backend_name() == 'sqlite':
+            event.listen(db.engine, 'connect', set_sqlite_pragmas)
         db.create_all()
-        print("Database tables created successfully!")
\ No newline at end of file
+        create_missing_indexes()
+        create_search_indexes()
+        ensure_attendance_summary()
+        print("Database tables created successfully!")
+
+def set_sqlite_pragmas(dbapi_conn, connection_record):
+    """WAL journal + NORMAL sync so uploads don't block dashboard reads on fsync"""
+    cursor = dbapi_conn.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA mmap_size=268435456')
+    cursor.close()
+
+def create_missing_indexes():
+    """Create model indexes on tables that existed before the index was added"""
+    # create_all() only creates indexes together with new tables
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(db.engine, checkfirst=True)
+            except Exception as e:
+                print(f"Could not create index {index.name}: {e}")
+
+def create_search_indexes():
+    """Create trigram indexes for ILIKE student search (PostgreSQL only)"""
+    if db.engine.url.get_backend_name() != 'postgresql':
+        return
+    
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+            conn.execute(text('CREATE INDEX IF NOT EXISTS students_name_trgm ON students USING gin (name gin_trgm_ops)'))
+            conn.execute(text('CREATE INDEX IF NOT EXISTS students_registration_no_trgm ON students USING gin (registration_no gin_trgm_ops)'))
+    except Exception as e:
+        print(f"Could not create search indexes: {e}")
\ No newline at end of file
@@ -1,82 +1,114 @@
 """
 Business logic for attendance calculations and data processing
 """
-from backend.models import db, Student, Course, AttendanceRecord
-from sqlalchemy import func, distinct
+from backend.models import (
+    db, Student, Course, AttendanceRecord, AttendanceSummary,
+    lock_attendance_summary, refresh_attendance_summary
+)
+from sqlalchemy import func, distinct, select, case, text
+from cachetools import TTLCache, cached
+import itertools
+import threading
+
+# Short-lived cache for read-mostly endpoints; cleared on every write
+_cache = TTLCache(maxsize=32, ttl=30)
+_cache_lock = threading.Lock()
 
 class AttendanceService:
     
     @staticmethod
-    def calculate_dashboard_stats():
-        """Calculate statistics for the dashboard (overall stats)"""
-        total_students = db.session.query(distinct(Student.id)).count()
-        total_courses = Course.query.count()
-        
-        low_attendance_count = AttendanceRecord.query.filter(
-            AttendanceRecord.attendance_percentage < 75
-        ).count()
-        
-        critical_attendance_count = AttendanceRecord.query.filter(
-            AttendanceRecord.attendance_percentage < 65
-        ).count()
-        
-        return {
-            'total_students': total_students,
-            'total_courses': total_courses,
-            'low_attendance_count': low_attendance_count,
-            'critical_attendance_count': critical_attendance_count
-        }
+    def invalidate_cache():
+        """Drop cached course list and dashboard stats after data changes"""
+        with _cache_lock:
+            _cache.clear()
     
     @staticmethod
-    def calculate_filtered_stats(course_code=None, threshold=75, search=None, exclude_courses=None):
-        """Calculate statistics based on applied filters"""
-        # Base query
-        query = db.session.query(AttendanceRecord).join(Student).join(Course)
+    def build_attendance_filters(course_code=None, threshold=None, search=None, exclude_courses=None):
+        """Build the WHERE clauses shared by the attendance queries (threshold=None skips it)"""
+        filters = []
         
         # Apply course filter
         if course_code:
-            query = query.filter(Course.course_code == course_code)
+            filters.append(Course.course_code == course_code)
         
         # Apply exclude courses filter
         if exclude_courses:
-            query = query.filter(~Course.course_code.in_(exclude_courses))
+            filters.append(~Course.course_code.in_(exclude_courses))
+        
+        if threshold is not None and threshold < 100:
+            filters.append(AttendanceRecord.attendance_percentage < threshold)
         
         # Apply search filter (for student info)
         if search:
-            search_lower = search.lower()
-            query = query.filter(
+            # Plain ILIKE on the columns so Postgres can use the trigram indexes
+            pattern = f'%{search}%'
+            filters.append(
                 db.or_(
-                    func.lower(Student.name).contains(search_lower),
-                    func.lower(Student.registration_no).contains(search_lower)
+                    Student.name.ilike(pattern),
+                    Student.registration_no.ilike(pattern)
                 )
             )
         
-        # Get all filtered records
-        filtered_records = query.all()
+        return filters
+    
+    @staticmethod
+    @cached(_cache, key=lambda: 'dashboard_stats', lock=_cache_lock)
+    def calculate_dashboard_stats():
+        """Calculate statistics for the dashboard (overall stats)"""
+        # Counts are maintained by refresh_attendance_summary() on every write
+        summary = db.session.get(AttendanceSummary, 1)
+        if summary is None:
+            return {
+                'total_students': 0,
+                'total_courses': 0,
+                'low_attendance_count': 0,
+                'critical_attendance_count': 0
+            }
+        return summary.to_dict()
+    
+    @staticmethod
+    def get_data_version():
+        """Last write time of the attendance data (the summary row's updated_at); not cached"""
+        updated_at = db.session.execute(
+            select(AttendanceSummary.updated_at).where(AttendanceSummary.id == 1)
+        ).scalar()
+        return updated_at.isoformat() if updated_at else ''
+    
+    @staticmethod
+    def calculate_filtered_stats(course_code=None, threshold=75, search=None, exclude_courses=None):
+        """Calculate statistics based on applied filters"""
+        # Stats count against actual percentages, so the threshold filter is not applied
+        filters = AttendanceService.build_attendance_filters(
+            course_code=course_code, search=search, exclude_courses=exclude_courses
+        )
+        
+        # Aggregate the filtered records in the database (one roundtrip, no ORM rows)
+        base = select(
+            AttendanceRecord.student_id,
+            AttendanceRecord.course_id,
+            AttendanceRecord.attendance_percentage
+        ).join(Student).join(Course).where(*filters).cte()
         
-        # Calculate stats from filtered records
-        unique_students = set()
-        unique_courses = set()
-        low_attendance_records = []
-        critical_attendance_records = []
-        student_details = None
+        # Check thresholds based on actual percentage, not filter threshold
+        total_students, total_courses, low_attendance_count, critical_attendance_count = db.session.execute(
+            select(
+                func.count(distinct(base.c.student_id)),
+                func.count(distinct(base.c.course_id)),
+                func.coalesce(func.sum(case((base.c.attendance_percentage < 75, 1), else_=0)), 0),
+                func.coalesce(func.sum(case((base.c.attendance_percentage < 65, 1), else_=0)), 0)
+            )
+        ).one()
         
-        for record in filtered_records:
-            unique_students.add(record.student.id)
-            unique_courses.add(record.course.id)
-            
-            # Store student details if search matches specific student
-            if search and len(unique_students) == 1:
+        # Store student details if search matches specific student
+        student_details = None
+        if search and total_students == 1:
+            student = db.session.query(Student.name, Student.registration_no)\
+                .join(AttendanceRecord).join(Course).filter(*filters).first()
+            if student:
                 student_details = {
-                    'name': record.student.name,
-                    'registration_no': record.student.registration_no
+                    'name': student.name,
+                    'registration_no': student.registration_no
                 }
-            
-            # Check thresholds based on actual percentage, not filter threshold
-            if record.attendance_percentage < 75:
-                low_attendance_records.append(record)
-            if record.attendance_percentage < 65:
-                critical_attendance_records.append(record)
         
         # Determine if showing all courses or filtered
         total_courses_in_system = Course.query.count()
@@ -93,8 +125,8 @@ class AttendanceService:
         
         # Get student's course count when searching for a student
         student_course_info = None
-        if search and len(unique_students) == 1:
-            student_course_count = len(unique_courses)
+        if search and total_students == 1:
+            student_course_count = total_courses
             # If single course selected, show the course code
             if course_code:
                 student_course_info = course_code
@@ -103,11 +135,11 @@ class AttendanceService:
                 student_course_info = f"{student_course_count} course{'s' if student_course_count != 1 else ''}"
         
         return {
-            'total_students': len(unique_students),
-            'total_courses': len(unique_courses),
-            'low_attendance_count': len(low_attendance_records),
-            'critical_attendance_count': len(critical_attendance_records),
-            'is_single_student': len(unique_students) == 1 and search,
+            'total_students': total_students,
+            'total_courses': total_courses,
+            'low_attendance_count': low_attendance_count,
+            'critical_attendance_count': critical_attendance_count,
+            'is_single_student': total_students == 1 and search,
             'student_details': student_details,
             'total_courses_in_system': total_courses_in_system,
             'course_details': course_details,
@@ -115,96 +147,138 @@ class AttendanceService:
         }
     
     @staticmethod
-    def get_filtered_attendance_records(course_code=None, threshold=75, search=None, exclude_courses=None):
-        """Get attendance records with applied filters"""
-        query = db.session.query(AttendanceRecord).join(Student).join(Course)
-        
-        # Apply filters
-        if course_code:
-            query = query.filter(Course.course_code == course_code)
+    def get_filtered_attendance_rows(course_code=None, threshold=75, search=None, exclude_courses=None,
+                                     limit=None, offset=0):
+        """Get filtered attendance as plain column tuples (no ORM objects) for the JSON API"""
+        stmt = select(
+            AttendanceRecord.id,
+            Student.registration_no,
+            Student.name,
+            Course.course_code,
+            Course.course_name,
+            AttendanceRecord.attended_periods,
+            AttendanceRecord.conducted_periods,
+            AttendanceRecord.attendance_percentage
+        ).select_from(AttendanceRecord).join(Student).join(Course).where(
+            *AttendanceService.build_attendance_filters(
+                course_code=course_code, threshold=threshold, search=search, exclude_courses=exclude_courses
+            )
+        ).order_by(
+            Course.course_code.asc(),
+            AttendanceRecord.attendance_percentage.asc(),
+            Student.registration_no.asc()
+        )
         
-        # Apply exclude courses filter
-        if exclude_courses:
-            query = query.filter(~Course.course_code.in_(exclude_courses))
+        # Optional page window, applied in SQL
+        if limit is not None:
+            stmt = stmt.limit(limit).offset(offset)
+        return db.session.execute(stmt).all()
+    
+    @staticmethod
+    def get_export_payload(course_code=None, threshold=75, search=None, exclude_courses=None):
+        """Get (rows, filter_info) for the Excel/PDF exports from a single column query"""
+        # A threshold of 100 or more means no threshold filter (export all students)
+        rows = AttendanceService.get_filtered_attendance_rows(
+            course_code=course_code,
+            threshold=threshold,
+            search=search,
+            exclude_courses=exclude_courses
+        )
         
+        # Describe the filters for the report title/filename
+        # (excluded courses are not included in filter_info/filename)
+        filter_info = []
+        if course_code:
+            filter_info.append(f"Course: {course_code}")
         if threshold < 100:
-            query = query.filter(AttendanceRecord.attendance_percentage < threshold)
-        
+            filter_info.append(f"Attendance below: {threshold}%")
         if search:
-            search_lower = search.lower()
-            query = query.filter(
-                db.or_(
-                    func.lower(Student.name).contains(search_lower),
-                    func.lower(Student.registration_no).contains(search_lower)
-                )
-            )
+            filter_info.append(f"Search: {search}")
         
-        return query.order_by(
-            Course.course_code.asc(),
-            AttendanceRecord.attendance_percentage.asc(),
-            Student.registration_no.asc()
-        ).all()
+        return rows, filter_info
     
     @staticmethod
-    def get_all_courses():
-        """Get all available courses sorted alphabetically"""
-        return Course.query.order_by(Course.course_code.asc()).all()
+    def get_course_export_payloads(course_code=None, threshold=75, search=None, exclude_courses=None):
+        """Get ([(rows, filter_info) per course], filter_info) for the per-course PDF bundle"""
+        rows, filter_info = AttendanceService.get_export_payload(
+            course_code=course_code,
+            threshold=threshold,
+            search=search,
+            exclude_courses=exclude_courses
+        )
+        other_filters = [f for f in filter_info if not f.startswith("Course: ")]
+        
+        # Rows are ordered by course code, so each course is one consecutive group
+        jobs = [
+            (list(course_rows), [f"Course: {code}"] + other_filters)
+            for code, course_rows in itertools.groupby(rows, key=lambda r: r.course_code)
+        ]
+        return jobs, filter_info
     
     @staticmethod
-    def get_low_attendance_records():
-        """Get records with attendance below 75%"""
-        return db.session.query(AttendanceRecord).join(Student).join(Course).filter(
-            AttendanceRecord.attendance_percentage < 75
-        ).order_by(
-            AttendanceRecord.attendance_percentage.asc(),
-            Student.registration_no.asc(),
-            Course.course_code.asc()
-        ).all()
+    def count_filtered_attendance(course_code=None, threshold=75, search=None, exclude_courses=None):
+        """Count attendance records matching the filters without loading them"""
+        stmt = select(func.count()).select_from(AttendanceRecord).join(Student).join(Course).where(
+            *AttendanceService.build_attendance_filters(
+                course_code=course_code, threshold=threshold, search=search, exclude_courses=exclude_courses
+            )
+        )
+        return db.session.execute(stmt).scalar()
     
     @staticmethod
-    def format_attendance_data_for_export(records):
-        """Format attendance records for API/display (includes id for deletion)"""
+    @cached(_cache, key=lambda: 'courses', lock=_cache_lock)
+    def get_all_courses():
+        """Get all available courses (code, name rows) sorted alphabetically"""
+        # Plain rows rather than ORM objects, so they stay valid in the cache
+        return db.session.query(Course.course_code, Course.course_name).order_by(Course.course_code.asc()).all()
+    
+    @staticmethod
+    def format_attendance_data_for_export(rows, start=1):
+        """Format attendance rows from get_filtered_attendance_rows for API/display (includes id for deletion)"""
         data = []
-        for i, record in enumerate(records, 1):
+        for i, (record_id, registration_no, student_name, course_code, course_name,
+                attended, conducted, percentage) in enumerate(rows, start):
             data.append({
-                'id': record.id,
+                'id': record_id,
                 'S.No': i,
-                'Registration No': record.student.registration_no,
-                'Student Name': record.student.name,
-                'Course Code': record.course.course_code,
-                'Course Name': record.course.course_name,
-                'Attended Periods': record.attended_periods,
-                'Conducted Periods': record.conducted_periods,
-                'Attendance %': round(record.attendance_percentage, 1)
+                'Registration No': registration_no,
+                'Student Name': student_name,
+                'Course Code': course_code,
+                'Course Name': course_name,
+                'Attended Periods': attended,
+                'Conducted Periods': conducted,
+                'Attendance %': round(percentage, 1)
             })
         return data
     
     @staticmethod
-    def format_attendance_data_for_file_export(records):
-        """Format attendance records for file export (Excel/PDF - no id)"""
-        data = []
-        for i, record in enumerate(records, 1):
-            data.append({
+    def format_attendance_data_for_file_export(rows):
+        """Yield attendance rows from get_filtered_attendance_rows formatted for file export (Excel/PDF - no id)"""
+        for i, (_, registration_no, student_name, course_code, course_name,
+                attended, conducted, percentage) in enumerate(rows, 1):
+            yield {
                 'S.No': i,
-                'Registration No': record.student.registration_no,
-                'Student Name': record.student.name,
-                'Course Code': record.course.course_code,
-                'Course Name': record.course.course_name,
-                'Attended Periods': record.attended_periods,
-                'Conducted Periods': record.conducted_periods,
-                'Attendance %': round(record.attendance_percentage, 1)
-            })
-        return data
+                'Registration No': registration_no,
+                'Student Name': student_name,
+                'Course Code': course_code,
+                'Course Name': course_name,
+                'Attended Periods': attended,
+                'Conducted Periods': conducted,
+                'Attendance %': round(percentage, 1)
+            }
     
     @staticmethod
     def delete_attendance_record(record_id):
         """Delete a specific attendance record"""
         try:
             from backend.models import AttendanceRecord
+            lock_attendance_summary()
             record = AttendanceRecord.query.get(record_id)
             if record:
                 db.session.delete(record)
+                refresh_attendance_summary()
                 db.session.commit()
+                AttendanceService.invalidate_cache()
                 return True
             return False
         except Exception as e:
@@ -217,13 +291,20 @@ class AttendanceService:
         """Clear all attendance data from database"""
         try:
             from backend.models import AttendanceRecord, Student, Course
-            # Delete all attendance records
-            AttendanceRecord.query.delete()
-            # Delete all students
-            Student.query.delete()
-            # Delete all courses
-            Course.query.delete()
+            lock_attendance_summary()
+            if db.engine.url.get_backend_name() == 'postgresql':
+                # One TRUNCATE skips row-by-row deletes, WAL logging and vacuum churn
+                db.session.execute(text('TRUNCATE TABLE attendance_records, students, courses RESTART IDENTITY CASCADE'))
+            else:
+                # Delete all attendance records
+                AttendanceRecord.query.delete(synchronize_session=False)
+                # Delete all students
+                Student.query.delete(synchronize_session=False)
+                # Delete all courses
+                Course.query.delete(synchronize_session=False)
+            refresh_attendance_summary()
             db.session.commit()
+            AttendanceService.invalidate_cache()
             return True
         except Exception as e:
             db.session.rollback()
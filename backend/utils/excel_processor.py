@@ -1,10 +1,88 @@
+import io
+import logging
+import numpy as np
+import openpyxl
 import pandas as pd
 import re
-from backend.models import db, Student, Course, AttendanceRecord
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from backend.models import db, Student, Course, AttendanceRecord, lock_attendance_summary, refresh_attendance_summary
+
+try:
+    # Rust-backed workbook reader for pd.read_excel(engine='calamine'); openpyxl is used without it
+    import python_calamine  # noqa: F401
+    CALAMINE_AVAILABLE = True
+except ImportError:
+    CALAMINE_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+def _percentage_kernel(attended, conducted, percentage, blank):
+    """Fused percentage fill: the sheet's value, or attended/conducted*100 where it was empty"""
+    out = np.empty(attended.shape[0])
+    for i in range(attended.shape[0]):
+        if blank[i]:
+            out[i] = attended[i] / conducted[i] * 100 if conducted[i] > 0 else 0.0
+        else:
+            out[i] = percentage[i]
+    return out
+
+
+# Courses with at least this many rows use the compiled kernel (when numba is installed)
+NUMBA_MIN_ROWS = 100_000
+
+try:
+    # Optional: LLVM-compiles the percentage fill for very large imports; NumPy is used without it
+    from numba import njit
+    _percentage_kernel_jit = njit(cache=True)(_percentage_kernel)
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Course code pattern like "22IT580", "22ECGDO", "22ITGB0", "22ITPK0", "22ITPQ0", etc.:
+# 2 digits + 4-5 alphanumeric characters, then " - <course name>"
+COURSE_CODE_RE = re.compile(r'(\d{2}[A-Z0-9]{4,5})\s*-\s*(.+)')
+
+# Keywords (uppercase) that identify the student header row
+HEADER_KEYWORDS = ('ADMISSION NO', 'REGISTRATION NO', 'STUDENT NAME')
+
+# Columns and dtypes of the attendance frame built by _process_dataframe
+ATTENDANCE_COLUMNS = {
+    'registration_no': 'category',
+    'course_code': 'category',
+    'course_name': 'object',
+    'attended_periods': 'int64',
+    'conducted_periods': 'int64',
+    'attendance_percentage': 'float64',
+}
+
+# Attendance records with fewer conducted periods are not stored
+MIN_CONDUCTED_PERIODS = 5
+
+# Dialect inserts that support ON CONFLICT DO NOTHING, by backend name
+DIALECT_INSERTS = {'postgresql': pg_insert, 'sqlite': sqlite_insert}
+
+# Keys per IN (...) lookup; keeps large rosters under SQLite's bound-parameter limit
+IN_BATCH_SIZE = 900
+
+# Update a stored record only while the new row still has more conducted periods, so a
+# concurrent upload that already stored a higher count is never overwritten
+_records = AttendanceRecord.__table__
+UPDATE_IF_MORE_CONDUCTED = update(_records).where(
+    _records.c.id == bindparam('b_id'),
+    _records.c.conducted_periods < bindparam('b_conducted')
+).values(
+    attended_periods=bindparam('b_attended'),
+    conducted_periods=bindparam('b_conducted'),
+    attendance_percentage=bindparam('b_percentage')
+)
 
 class ExcelProcessor:
-    def __init__(self):
+    def __init__(self, engine='calamine'):
         self.course_mapping = {}
+        self.engine = engine
         
     def extract_course_info_from_header(self, df):
         """Extract course information from the Excel header rows"""
@@ -14,10 +92,8 @@ class ExcelProcessor:
         if len(df) > 4:
             course_row = df.iloc[4]
             for col_idx, cell_value in enumerate(course_row):
-                if pd.notna(cell_value) and isinstance(cell_value, str):
-                    # Look for course code pattern like "22IT580", "22ECGDO", "22ITGB0", "22ITPK0", "22ITPQ0", etc.
-                    # Pattern: 2 digits + 4-5 alphanumeric characters (updated to better match actual formats)
-                    course_match = re.search(r'(\d{2}[A-Z0-9]{4,5})\s*-\s*(.+)', str(cell_value))
+                if isinstance(cell_value, str):
+                    course_match = COURSE_CODE_RE.search(cell_value)
                     if course_match:
                         course_code = course_match.group(1)
                         course_name = course_match.group(2).strip()
@@ -30,10 +106,11 @@ class ExcelProcessor:
     
     def find_data_start_row(self, df):
         """Find the row where actual student data starts"""
-        for idx, row in df.iterrows():
-            row_str = ' '.join([str(x) for x in row.tolist() if pd.notna(x)]).upper()
+        # Plain tuples (no Series per row); the header is near the top, so stop at the first hit
+        for idx, *row in df.itertuples(index=True, name=None):
+            row_str = ' '.join([str(x) for x in row if pd.notna(x)]).upper()
             # Look for header row with these keywords
-            if any(keyword in row_str for keyword in ['ADMISSION NO', 'REGISTRATION NO', 'STUDENT NAME']):
+            if any(keyword in row_str for keyword in HEADER_KEYWORDS):
                 return idx + 1  # Data starts after header
         return 7  # Default fallback based on our analysis
     
@@ -41,16 +118,18 @@ class ExcelProcessor:
         """Map column indices to course data"""
         column_mapping = {}
         
-        # Standard columns
-        for idx, col_name in enumerate(header_row):
-            if pd.notna(col_name):
-                col_name_str = str(col_name).upper()
-                if 'ADMISSION' in col_name_str:
-                    column_mapping['admission_no'] = idx
-                elif 'REGISTRATION' in col_name_str:
-                    column_mapping['registration_no'] = idx
-                elif 'STUDENT NAME' in col_name_str or 'NAME' in col_name_str:
-                    column_mapping['student_name'] = idx
+        # Upper-cased header labels, matched column-wise ('' for empty cells)
+        labels = pd.Series(header_row, dtype=object)
+        labels = labels.map(str, na_action='ignore').fillna('').str.upper()
+        
+        # Standard columns (the last matching column wins)
+        is_admission = labels.str.contains('ADMISSION', regex=False)
+        is_registration = ~is_admission & labels.str.contains('REGISTRATION', regex=False)
+        is_name = ~is_admission & ~is_registration & labels.str.contains('NAME', regex=False)
+        for key, mask in (('admission_no', is_admission), ('registration_no', is_registration), ('student_name', is_name)):
+            matches = np.flatnonzero(mask.to_numpy())
+            if len(matches):
+                column_mapping[key] = int(matches[-1])
         
         # Course-specific columns
         # Based on our analysis, courses appear in groups of 3 columns (attended, conducted, percentage)
@@ -60,12 +139,8 @@ class ExcelProcessor:
         course_list = [(col_idx, info) for col_idx, info in sorted(courses_info.items())]
         
         # Find groups of 3 columns starting after basic student info (typically after column 2)
-        attended_col_indices = []
-        for idx in range(3, len(header_row)):
-            if pd.notna(header_row[idx]):
-                col_name = str(header_row[idx]).upper()
-                if 'ATTENDED' in col_name:
-                    attended_col_indices.append(idx)
+        is_attended = labels.str.contains('ATTENDED', regex=False) & (labels.index >= 3)
+        attended_col_indices = np.flatnonzero(is_attended.to_numpy()).tolist()
         
         # Map each course to its corresponding column group
         for i, (course_col_idx, course_info) in enumerate(course_list):
@@ -82,29 +157,19 @@ class ExcelProcessor:
         column_mapping['courses'] = course_columns
         return column_mapping
     
-    def process_excel_file_from_memory(self, file):
-        """Process Excel/CSV file directly from memory and extract attendance data"""
+    def process_excel_file_from_memory(self, filename, content):
+        """Process Excel/CSV file contents (raw bytes or a binary file object) and extract attendance data"""
         try:
-            # Reset file pointer to beginning
-            file.seek(0)
+            # File objects are read in place; bytes are wrapped without another copy
+            buffer = content if hasattr(content, 'read') else io.BytesIO(content)
             
-            if file.filename.lower().endswith(('.csv',)):
-                df = pd.read_csv(file)
+            if filename.lower().endswith(('.csv',)):
+                df = pd.read_csv(buffer, dtype=str)
             else:
-                df = pd.read_excel(file)
+                df = self._read_workbook(buffer, filename)
             
-            result = self._process_dataframe(df)
-            # Free memory used by DataFrame ASAP
-            try:
-                del df
-            except Exception:
-                pass
-            try:
-                import gc
-                gc.collect()
-            except Exception:
-                pass
-            return result
+            # The DataFrame is freed by refcounting when this returns; no full gc pass needed
+            return self._process_dataframe(df)
             
         except Exception as e:
             print(f"Error processing Excel file: {e}")
@@ -114,27 +179,74 @@ class ExcelProcessor:
         """Process Excel/CSV file and extract attendance data"""
         try:
             if file_path.lower().endswith(('.csv',)):
-                df = pd.read_csv(file_path)
+                df = pd.read_csv(file_path, dtype=str)
             else:
-                df = pd.read_excel(file_path)
+                df = self._read_workbook(file_path, file_path)
             
-            result = self._process_dataframe(df)
-            # Free memory used by DataFrame ASAP
-            try:
-                del df
-            except Exception:
-                pass
-            try:
-                import gc
-                gc.collect()
-            except Exception:
-                pass
-            return result
+            # The DataFrame is freed by refcounting when this returns; no full gc pass needed
+            return self._process_dataframe(df)
             
         except Exception as e:
             print(f"Error processing Excel file: {e}")
             return None
     
+    def _read_workbook(self, source, filename):
+        """Read the first worksheet of an .xlsx/.xls file, preferring the calamine engine.
+        
+        Cells keep their own types (dtype=object) so numeric ID columns with blanks
+        are never coerced to float ("2212001.0").
+        """
+        if self.engine == 'calamine' and CALAMINE_AVAILABLE:
+            try:
+                return pd.read_excel(source, engine='calamine', dtype=object)
+            except Exception as e:
+                logger.warning("Calamine could not read %s, falling back to openpyxl: %s", filename, e)
+                if hasattr(source, 'seek'):
+                    source.seek(0)
+        
+        if filename.lower().endswith(('.xlsx',)):
+            return self._read_xlsx_streaming(source)
+        return pd.read_excel(source, dtype=object)
+    
+    def _read_xlsx_streaming(self, source):
+        """Read the first worksheet with openpyxl in read-only mode, one row at a time"""
+        wb = openpyxl.load_workbook(filename=source, read_only=True, data_only=True, keep_links=False)
+        try:
+            ws = wb.worksheets[0]
+            # Some exporters write wrong sheet dimensions; let openpyxl size rows from the data
+            ws.reset_dimensions()
+            rows = [
+                # Whole-number floats become ints, as pd.read_excel does
+                tuple(int(v) if isinstance(v, float) and v.is_integer() else v for v in row)
+                for row in ws.iter_rows(values_only=True)
+            ]
+        finally:
+            wb.close()
+        
+        # First row is the header row, matching pd.read_excel's default
+        return pd.DataFrame(rows[1:], dtype=object)
+    
+    @staticmethod
+    def _text_column(values):
+        """Cells of a column as str, with '' for empty cells"""
+        return values.astype(object).map(str, na_action='ignore').fillna('')
+    
+    @staticmethod
+    def _numeric_column(values):
+        """Cells of a column as floats (NaN when empty, '-' or not a number) plus the empty/'-' mask"""
+        blank = (values.isna() | values.astype(object).map(str).eq('-')).to_numpy()
+        numbers = pd.to_numeric(values.astype(object).where(~blank), errors='coerce').to_numpy(dtype=float)
+        return numbers, blank
+    
+    @staticmethod
+    def _fill_percentages(attended, conducted, percentage, blank):
+        """Use the sheet's percentage, or attended/conducted*100 (0 when nothing was conducted) where it is empty"""
+        if NUMBA_AVAILABLE and len(attended) >= NUMBA_MIN_ROWS:
+            return _percentage_kernel_jit(attended, conducted, percentage, blank)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            computed = np.where(conducted > 0, attended / conducted * 100, 0.0)
+        return np.where(blank, computed, percentage)
+    
     def _process_dataframe(self, df):
         """Common dataframe processing logic"""
         try:
@@ -150,71 +262,81 @@ class ExcelProcessor:
             column_mapping = self.map_columns_to_courses(header_row, courses_info)
             print(f"Column mapping: {column_mapping}")
             
-            # Process student data
-            students_data = []
-            attendance_data = []
+            # Student rows after the header, sliced once as whole columns; empty rows dropped upfront
+            sub = df.iloc[data_start_row:]
+            sub = sub[sub.notna().any(axis=1)].reset_index(drop=True)
+            n_cols = sub.shape[1]
+            student_cols = [
+                column_mapping.get('admission_no', 0),
+                column_mapping.get('registration_no', 1),
+                column_mapping.get('student_name', 2),
+            ]
+            if max(student_cols) >= n_cols:
+                logger.warning("Student columns %s are outside the sheet (%d columns)", student_cols, n_cols)
+                sub = sub.iloc[0:0]
+                student_cols = [0, 0, 0]
             
-            for idx in range(data_start_row, len(df)):
-                row = df.iloc[idx]
-                
-                # Skip empty rows
-                if row.isna().all():
+            admission_no, registration_no, student_name = (
+                self._text_column(sub.iloc[:, col]) for col in student_cols
+            )
+            valid = (registration_no != '') & (registration_no != 'nan')
+            positions = np.flatnonzero(valid.to_numpy())
+            reg_values = registration_no.to_numpy(dtype=object)[positions]
+            # Column-oriented (SoA) frames; save_to_database works on the columns directly
+            students_df = pd.DataFrame({
+                'admission_no': admission_no[valid].to_numpy(dtype=object),
+                'registration_no': reg_values,
+                'name': student_name[valid].to_numpy(dtype=object),
+            })
+            
+            # Attendance for each course, computed column-wise over the valid student rows
+            course_name_by_code = {info['code']: info['name'] for info in courses_info.values()}
+            parts = []
+            for order, (course_code, course_cols) in enumerate(column_mapping.get('courses', {}).items()):
+                if max(course_cols.values()) >= n_cols:
+                    logger.warning("Columns for course %s are outside the sheet, skipping", course_code)
                     continue
                 
-                # Extract student info
-                try:
-                    admission_no = str(row.iloc[column_mapping.get('admission_no', 0)]) if pd.notna(row.iloc[column_mapping.get('admission_no', 0)]) else ''
-                    registration_no = str(row.iloc[column_mapping.get('registration_no', 1)]) if pd.notna(row.iloc[column_mapping.get('registration_no', 1)]) else ''
-                    student_name = str(row.iloc[column_mapping.get('student_name', 2)]) if pd.notna(row.iloc[column_mapping.get('student_name', 2)]) else ''
-                    
-                    if not registration_no or registration_no == 'nan':
-                        continue
-                        
-                    student_data = {
-                        'admission_no': admission_no,
-                        'registration_no': registration_no,
-                        'name': student_name
-                    }
-                    students_data.append(student_data)
-                    
-                    # Extract attendance for each course
-                    for course_code, course_cols in column_mapping.get('courses', {}).items():
-                        try:
-                            attended = row.iloc[course_cols.get('attended', -1)]
-                            conducted = row.iloc[course_cols.get('conducted', -1)]
-                            percentage = row.iloc[course_cols.get('percentage', -1)]
-                            
-                            # Handle cases where attendance might be '-' or empty
-                            if pd.notna(attended) and str(attended) != '-' and pd.notna(conducted) and str(conducted) != '-':
-                                attended = int(float(attended))
-                                conducted = int(float(conducted))
-                                
-                                # Calculate percentage if not provided or invalid
-                                if pd.isna(percentage) or str(percentage) == '-':
-                                    percentage = (attended / conducted * 100) if conducted > 0 else 0
-                                else:
-                                    percentage = float(percentage)
-                                
-                                attendance_record = {
-                                    'registration_no': registration_no,
-                                    'course_code': course_code,
-                                    'course_name': courses_info[list(courses_info.keys())[0]]['name'] if courses_info else '',
-                                    'attended_periods': attended,
-                                    'conducted_periods': conducted,
-                                    'attendance_percentage': percentage
-                                }
-                                attendance_data.append(attendance_record)
-                        except (ValueError, IndexError) as e:
-                            print(f"Error processing attendance for {student_name}, course {course_code}: {e}")
-                            continue
-                            
-                except (ValueError, IndexError) as e:
-                    print(f"Error processing row {idx}: {e}")
-                    continue
+                attended, _ = self._numeric_column(sub.iloc[positions, course_cols['attended']])
+                conducted, _ = self._numeric_column(sub.iloc[positions, course_cols['conducted']])
+                percentage, pct_blank = self._numeric_column(sub.iloc[positions, course_cols['percentage']])
+                
+                # Rows with '-'/empty periods are skipped, as are non-numeric percentages
+                keep = ~np.isnan(attended) & ~np.isnan(conducted) & ~(np.isnan(percentage) & ~pct_blank)
+                attended = np.trunc(attended[keep])
+                conducted = np.trunc(conducted[keep])
+                
+                # Calculate percentage if not provided
+                percentage = self._fill_percentages(attended, conducted, percentage[keep], pct_blank[keep])
+                
+                parts.append(pd.DataFrame({
+                    'row': positions[keep],
+                    'course_order': order,
+                    'registration_no': reg_values[keep],
+                    'course_code': course_code,
+                    'course_name': course_name_by_code.get(course_code, ''),
+                    'attended_periods': attended.astype(np.int64),
+                    'conducted_periods': conducted.astype(np.int64),
+                    'attendance_percentage': percentage,
+                }))
+            
+            if parts:
+                # Keep the sheet's row order, courses in mapping order within a row
+                attendance_df = (
+                    pd.concat(parts, ignore_index=True)
+                    .sort_values(['row', 'course_order'], kind='stable')
+                    .drop(columns=['row', 'course_order'])
+                    .reset_index(drop=True)
+                )
+                # Each code repeats once per student/course; categories store it once plus small integer codes
+                attendance_df = attendance_df.astype({'registration_no': 'category', 'course_code': 'category'})
+            else:
+                # No course columns: same typed columns, so the save path's numeric steps still work
+                attendance_df = pd.DataFrame(columns=list(ATTENDANCE_COLUMNS)).astype(ATTENDANCE_COLUMNS)
             
             return {
-                'students': students_data,
-                'attendance': attendance_data,
+                'students': students_df,
+                'attendance': attendance_df,
                 'courses': courses_info
             }
             
@@ -222,102 +344,169 @@ class ExcelProcessor:
             print(f"Error processing dataframe: {e}")
             return None
     
+    @staticmethod
+    def _batches(values, size=IN_BATCH_SIZE):
+        """Split values into lists small enough for one IN (...) clause"""
+        values = list(values)
+        return [values[i:i + size] for i in range(0, len(values), size)]
+    
+    @classmethod
+    def _lookup_ids(cls, key_column, id_column, keys):
+        """Map key -> id for the given keys, querying in IN (...) batches"""
+        ids = {}
+        for batch in cls._batches(keys):
+            ids.update(db.session.query(key_column, id_column).filter(key_column.in_(batch)))
+        return ids
+    
+    @classmethod
+    def _insert_missing(cls, model, key, rows):
+        """Multi-row INSERT of rows whose key is not stored yet (ON CONFLICT DO NOTHING where supported)"""
+        if not rows:
+            return
+        dialect_insert = DIALECT_INSERTS.get(db.engine.url.get_backend_name())
+        if dialect_insert is not None:
+            stmt = dialect_insert(model.__table__).on_conflict_do_nothing(index_elements=[key])
+            db.session.execute(stmt, rows)
+            return
+        
+        # Other databases: skip the keys that already exist, then insert the rest
+        column = getattr(model, key)
+        existing = cls._lookup_ids(column, model.id, [row[key] for row in rows])
+        missing = [row for row in rows if row[key] not in existing]
+        if missing:
+            db.session.execute(insert(model), missing)
+    
+    @staticmethod
+    def _insert_attendance_records(rows):
+        """Multi-row INSERT of new attendance records; on a student/course conflict the stored
+        record is only replaced when the new row has more conducted periods"""
+        if not rows:
+            return
+        dialect_insert = DIALECT_INSERTS.get(db.engine.url.get_backend_name())
+        if dialect_insert is None:
+            db.session.execute(insert(AttendanceRecord), rows)
+            return
+        
+        # Another upload can store the same student/course between our lookup and this insert
+        stmt = dialect_insert(AttendanceRecord.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['student_id', 'course_id'],
+            set_={
+                'attended_periods': stmt.excluded.attended_periods,
+                'conducted_periods': stmt.excluded.conducted_periods,
+                'attendance_percentage': stmt.excluded.attendance_percentage,
+            },
+            where=stmt.excluded.conducted_periods > AttendanceRecord.__table__.c.conducted_periods
+        )
+        db.session.execute(stmt, rows)
+    
     def save_to_database(self, processed_data):
-        """Save the processed data to database with batched commits to reduce memory"""
+        """Save the processed data to database with bulk lookups and multi-row inserts"""
         if not processed_data:
             return False
         
         try:
-            # Save courses
+            # Unique courses/students in this file (first occurrence wins)
+            courses = {}
             for course_info in processed_data['courses'].values():
-                existing_course = Course.query.filter_by(course_code=course_info['code']).first()
-                if not existing_course:
-                    course = Course(
-                        course_code=course_info['code'],
-                        course_name=course_info['name']
-                    )
-                    db.session.add(course)
-            
-            # Save students
-            for student_data in processed_data['students']:
-                existing_student = Student.query.filter_by(registration_no=student_data['registration_no']).first()
-                if not existing_student:
-                    student = Student(
-                        admission_no=student_data['admission_no'],
-                        registration_no=student_data['registration_no'],
-                        name=student_data['name']
-                    )
-                    db.session.add(student)
+                courses.setdefault(course_info['code'], course_info['name'])
+            students = processed_data['students'].drop_duplicates('registration_no')
+            
+            # Writers in other processes wait here, so the summary refresh counts their rows
+            lock_attendance_summary()
             
+            # Save courses and students that are not in the database yet (existing rows are left as they are)
+            self._insert_missing(Course, 'course_code', [
+                {'course_code': code, 'course_name': name} for code, name in courses.items()
+            ])
+            self._insert_missing(Student, 'registration_no', students.to_dict('records'))
+            
+            refresh_attendance_summary()
             db.session.commit()  # Commit students and courses first
+            lock_attendance_summary()  # Same for the attendance record transaction
             
-            # Save attendance records with batched commits (every 500 records)
-            BATCH_SIZE = 500
-            batch_count = 0
-            total_added = 0
-            total_updated = 0
-            total_skipped = 0
-            
-            for i, attendance_data in enumerate(processed_data['attendance']):
-                # Skip records with less than 5 conducted periods
-                if attendance_data['conducted_periods'] < 5:
-                    print(f"Skipping record for {attendance_data['registration_no']} - {attendance_data['course_code']}: Only {attendance_data['conducted_periods']} classes conducted (minimum 5 required)")
-                    total_skipped += 1
-                    continue
-                
-                student = Student.query.filter_by(registration_no=attendance_data['registration_no']).first()
-                course = Course.query.filter_by(course_code=attendance_data['course_code']).first()
-                
-                if student and course:
-                    # Check if record already exists
-                    existing_record = AttendanceRecord.query.filter_by(
-                        student_id=student.id,
-                        course_id=course.id
-                    ).first()
-                    
-                    if existing_record:
-                        # Only update if new record has more conducted periods
-                        if attendance_data['conducted_periods'] > existing_record.conducted_periods:
-                            print(f"Updating record for {attendance_data['registration_no']} - {attendance_data['course_code']}: {existing_record.conducted_periods} -> {attendance_data['conducted_periods']} classes")
-                            existing_record.attended_periods = attendance_data['attended_periods']
-                            existing_record.conducted_periods = attendance_data['conducted_periods']
-                            existing_record.attendance_percentage = attendance_data['attendance_percentage']
-                            total_updated += 1
-                        else:
-                            print(f"Skipping record for {attendance_data['registration_no']} - {attendance_data['course_code']}: Existing record has more/equal classes ({existing_record.conducted_periods} >= {attendance_data['conducted_periods']})")
-                            total_skipped += 1
-                    else:
-                        # Create new record
-                        print(f"Adding new record for {attendance_data['registration_no']} - {attendance_data['course_code']}: {attendance_data['conducted_periods']} classes")
-                        record = AttendanceRecord(
-                            student_id=student.id,
-                            course_id=course.id,
-                            attended_periods=attendance_data['attended_periods'],
-                            conducted_periods=attendance_data['conducted_periods'],
-                            attendance_percentage=attendance_data['attendance_percentage']
-                        )
-                        db.session.add(record)
-                        total_added += 1
-                
-                batch_count += 1
-                
-                # Commit and clear session every BATCH_SIZE records to reduce memory
-                if batch_count >= BATCH_SIZE:
-                    db.session.commit()
-                    db.session.expire_all()  # Clear session cache
-                    print(f"[Batch commit] Processed {i+1}/{len(processed_data['attendance'])} records (added: {total_added}, updated: {total_updated}, skipped: {total_skipped})")
-                    batch_count = 0
-                    
-                    # Trigger garbage collection
-                    try:
-                        import gc
-                        gc.collect()
-                    except Exception:
-                        pass
-            
-            # Final commit for remaining records
+            course_ids = self._lookup_ids(Course.course_code, Course.id, courses)
+            student_ids = self._lookup_ids(Student.registration_no, Student.id, students['registration_no'].tolist())
+            
+            # Drop records with too few conducted periods before any further work
+            attendance = processed_data['attendance']
+            low = attendance['conducted_periods'] < MIN_CONDUCTED_PERIODS
+            total_skipped = int(low.sum())
+            if total_skipped:
+                logger.info("Skipped %d records with fewer than %d conducted periods", total_skipped, MIN_CONDUCTED_PERIODS)
+            if logger.isEnabledFor(logging.DEBUG):
+                for reg, code, conducted in attendance.loc[low, ['registration_no', 'course_code', 'conducted_periods']].itertuples(index=False, name=None):
+                    logger.debug("Skipping record for %s - %s: Only %s classes conducted (minimum %d required)",
+                                 reg, code, conducted, MIN_CONDUCTED_PERIODS)
+            
+            records = attendance[~low].assign(
+                student_id=lambda d: d['registration_no'].map(student_ids),
+                course_id=lambda d: d['course_code'].map(course_ids),
+            ).dropna(subset=['student_id', 'course_id'])
+            records = records.astype({'student_id': 'int64', 'course_id': 'int64'})
+            
+            # Stored records, only for the students that still have rows to write
+            existing_rows = []
+            course_id_values = list(course_ids.values())
+            for batch in self._batches(records['student_id'].unique().tolist()):
+                existing_rows.extend(db.session.execute(
+                    select(
+                        AttendanceRecord.id, AttendanceRecord.student_id,
+                        AttendanceRecord.course_id, AttendanceRecord.conducted_periods
+                    ).where(
+                        AttendanceRecord.student_id.in_(batch),
+                        AttendanceRecord.course_id.in_(course_id_values)
+                    )
+                ))
+            existing = pd.DataFrame(
+                existing_rows, columns=['record_id', 'student_id', 'course_id', 'existing_conducted']
+            ).astype({'record_id': 'float64', 'student_id': 'int64', 'course_id': 'int64', 'existing_conducted': 'float64'})
+            
+            records = records.merge(existing, on=['student_id', 'course_id'], how='left')
+            
+            # A record wins when it has more conducted periods than the stored record and every
+            # earlier row for the same student/course in this file
+            grouped = records.groupby(['student_id', 'course_id'], sort=False)['conducted_periods']
+            previous = grouped.cummax().groupby([records['student_id'], records['course_id']], sort=False).shift()
+            previous = np.fmax(previous.astype('float64'), records['existing_conducted'])
+            is_new = previous.isna()
+            improves = is_new | (records['conducted_periods'] > previous)
+            
+            total_added = int(is_new.sum())
+            total_updated = int((improves & ~is_new).sum())
+            total_skipped += int((~improves).sum())
+            
+            if logger.isEnabledFor(logging.DEBUG):
+                rows = zip(records['registration_no'], records['course_code'], records['conducted_periods'],
+                           records['existing_conducted'], previous, is_new, improves)
+                for reg, code, conducted, stored, prev, new, better in rows:
+                    if new:
+                        logger.debug("Adding new record for %s - %s: %s classes", reg, code, conducted)
+                    elif pd.notna(stored) and better:
+                        logger.debug("Updating record for %s - %s: %s -> %s classes", reg, code, int(prev), conducted)
+                    elif pd.notna(stored):
+                        logger.debug("Skipping record for %s - %s: Existing record has more/equal classes (%s >= %s)",
+                                     reg, code, int(prev), conducted)
+            
+            # The last winning row per student/course holds the highest conducted periods
+            winners = records[improves].drop_duplicates(['student_id', 'course_id'], keep='last')
+            values = ['attended_periods', 'conducted_periods', 'attendance_percentage']
+            new_records = winners.loc[winners['record_id'].isna(), ['student_id', 'course_id'] + values]
+            updated_records = (
+                winners.loc[winners['record_id'].notna(), ['record_id'] + values]
+                .rename(columns={'record_id': 'b_id', 'attended_periods': 'b_attended',
+                                 'conducted_periods': 'b_conducted', 'attendance_percentage': 'b_percentage'})
+                .astype({'b_id': 'int64'})
+            )
+            
+            # One multi-row INSERT for all new attendance records, one executemany UPDATE by primary key
+            self._insert_attendance_records(new_records.to_dict('records'))
+            if len(updated_records):
+                db.session.execute(UPDATE_IF_MORE_CONDUCTED, updated_records.to_dict('records'))
+            
+            refresh_attendance_summary()
             db.session.commit()
-            print(f"[Final] Total processed: added={total_added}, updated={total_updated}, skipped={total_skipped}")
+            logger.info("[Final] Total processed: added=%d, updated=%d, skipped=%d", total_added, total_updated, total_skipped)
             return True
             
         except Exception as e:
@@ -325,9 +514,11 @@ class ExcelProcessor:
             print(f"Error saving to database: {e}")
             return False
     
-    def cleanup_insufficient_records(self, min_conducted_periods=5):
+    def cleanup_insufficient_records(self, min_conducted_periods=MIN_CONDUCTED_PERIODS):
         """Remove existing records that don't meet minimum conducted periods requirement"""
         try:
+            lock_attendance_summary()
+            
             # Find and delete records with less than minimum conducted periods
             insufficient_records = AttendanceRecord.query.filter(
                 AttendanceRecord.conducted_periods < min_conducted_periods
@@ -339,6 +530,7 @@ class ExcelProcessor:
                 print(f"Removing record for {record.student.registration_no} - {record.course.course_code}: Only {record.conducted_periods} classes")
                 db.session.delete(record)
             
+            refresh_attendance_summary()
             db.session.commit()
             print(f"Cleaned up {deleted_count} records with insufficient conducted periods")
             return deleted_count
@@ -3,71 +3,223 @@ Utilities for exporting attendance data to Excel and PDF with formatting.
 Matches the layout shown in export_utils1.py (styled headers, auto widths, timestamped filenames),
 while keeping the same public methods used by the app.
 """
+import contextlib
+import functools
+import gzip
+import hashlib
 import io
+import itertools
+import operator
+import shutil
+import tempfile
+import zipfile
+from types import MappingProxyType
+from xml.sax.saxutils import escape
 from datetime import datetime
-import pandas as pd
-from flask import make_response
+import numpy as np
+import xlsxwriter
+from flask import request, send_file
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.platypus import SimpleDocTemplate, LongTable, TableStyle, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.pdfbase import pdfmetrics
 
+# Exports larger than this are spooled to disk while they are built and sent
+SPOOL_MAX_SIZE = 1024 * 1024
+
+# Characters removed from filter labels when they are used as a download name
+_FILTER_TRANS = str.maketrans('', '', ':,|"\'')
+
+# PDF paragraph styles, built once and only read afterwards
+_STYLES = getSampleStyleSheet()
+_TITLE_STYLE = ParagraphStyle(
+    'CustomTitle', parent=_STYLES['Heading1'], fontSize=18, spaceAfter=7, alignment=1
+)
+_FILTER_STYLE = ParagraphStyle(
+    'FilterInfo', parent=_STYLES['Normal'], fontSize=11, leading=11, wordWrap='CJK'
+)
+_CELL_STYLE = ParagraphStyle(
+    'Cell', parent=_STYLES['Normal'], fontName='Helvetica', fontSize=8, leading=10, wordWrap='LTR', alignment=1
+)
+
+# Excel header cell format; one shared dict so every workbook gets the same single <xf>
+_HEADER_FMT = MappingProxyType({
+    'bold': True,
+    'text_wrap': True,
+    'valign': 'top',
+    'fg_color': '#D7E4BC',
+    'border': 1,
+})
+
+# Column widths for the Excel export of format_attendance_data_for_file_export rows
+_LOW_ATTENDANCE_WIDTHS = {
+    'S.No': 8,
+    'Registration No': 18,
+    'Student Name': 32,
+    'Course Code': 13,
+    'Course Name': 40,
+    'Attended Periods': 18,
+    'Conducted Periods': 19,
+    'Attendance %': 14,
+}
+
+# Record fields used by the PDF report, in column order
+_PDF_FIELDS = operator.attrgetter(
+    'course_code', 'registration_no', 'name',
+    'attended_periods', 'conducted_periods', 'attendance_percentage'
+)
+# "0".."100" for the percentage column; round() matches f"{pct:.0f}" (half to even)
+_PCT_STRS = tuple(str(i) for i in range(101))
+
+
+def _pct_str(pct):
+    """Whole-number percentage text, from the lookup table for the usual 0-100 range"""
+    if 0 <= pct <= 100:
+        return _PCT_STRS[round(pct)]
+    return f"{pct:.0f}"
+
+
+@functools.lru_cache(maxsize=1024)
+def _string_width(text, font, size):
+    """pdfmetrics.stringWidth, cached: the header texts and fonts are the same on every export"""
+    return pdfmetrics.stringWidth(text, font, size)
+
 
 class ExportUtils:
     def _timestamp_for_filename(self) -> str:
         # Example: 01.10.2025 23 05 42
         return datetime.now().strftime("%d.%m.%Y %H %M %S")
 
-    def generate_excel_export(self, data, filter_info=None, filename_prefix: str = "attendance"):
-        """Generate formatted Excel from export-ready rows (list of dict)."""
-        df = pd.DataFrame(data or [])
-
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            sheet_name = 'Low Attendance Report'
-            df.to_excel(writer, sheet_name=sheet_name, index=False)
-
-            workbook = writer.book
-            worksheet = writer.sheets[sheet_name]
-
-            header_format = workbook.add_format({
-                'bold': True,
-                'text_wrap': True,
-                'valign': 'top',
-                'fg_color': '#D7E4BC',
-                'border': 1,
-            })
-
-            # Apply header styling
-            for col_num, value in enumerate(df.columns.values):
-                worksheet.write(0, col_num, value, header_format)
-
-            # Auto-fit columns
-            for i, col in enumerate(df.columns):
-                max_len = max(df[col].astype(str).apply(len).max() if not df.empty else 0, len(str(col))) + 2
-                worksheet.set_column(i, i, max_len)
+    def export_etag(self, data_version):
+        """Weak ETag for the current export request: its path and filters plus the data version.
 
-        output.seek(0)
+        Export bodies carry a generation timestamp, so they are never byte-identical; the tag
+        instead names "this report over this data", which is unchanged until the next write.
+        """
+        key = f"{request.full_path}|{data_version}"
+        return hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()
 
-        # Build dynamic filename based on filter_info
+    def _export_filename(self, filter_info, extension):
+        """Download name built from the applied filters, e.g. "Course 22IT580 Attendance below 75.0%.pdf"."""
         if filter_info:
-            filter_str = " ".join(str(f).replace(":", "").replace(",", "").replace("|", "") for f in filter_info)
-            filename = f"{filter_str}.xlsx"
-        else:
-            filename = "attendance.xlsx"
-        
-        # Sanitize filename to prevent header issues
-        filename = filename.replace('"', '').replace("'", "")
-        
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+            # One translate pass drops separators and the quotes that would break the header
+            return " ".join(str(f).translate(_FILTER_TRANS) for f in filter_info) + f".{extension}"
+        return f"attendance.{extension}"
+
+    @contextlib.contextmanager
+    def _spooled_file(self):
+        """New spooled temp file for an export body; closed again if building the export fails."""
+        output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode='w+b')
+        try:
+            yield output
+        except BaseException:
+            output.close()
+            raise
+
+    def _gzip_file(self, output):
+        """Gzip a finished file into a new spooled temp file, chunk by chunk."""
+        try:
+            with self._spooled_file() as compressed:
+                output.seek(0)
+                with gzip.GzipFile(fileobj=compressed, mode='wb', compresslevel=6, mtime=0) as gz:
+                    shutil.copyfileobj(output, gz, 65536)
+        finally:
+            output.close()
+        return compressed
+
+    def _file_response(self, output, filename, mimetype, compress=False):
+        """Send a finished (spooled temp) file as a download without copying it into bytes.
+
+        With compress=True the body is gzipped for clients that accept it (worth it for PDFs;
+        XLSX files are zip archives already).
+        """
+        gzipped = compress and request.accept_encodings['gzip'] > 0
+        if gzipped:
+            output = self._gzip_file(output)
+        size = output.seek(0, io.SEEK_END)
+        output.seek(0)
+        response = send_file(output, mimetype=mimetype, as_attachment=True,
+                             download_name=filename, conditional=False)
+        response.content_length = size
+        if compress:
+            response.vary.add('Accept-Encoding')
+        if gzipped:
+            response.content_encoding = 'gzip'
         return response
 
+    def generate_excel_export(self, data, filter_info=None, filename_prefix: str = "attendance"):
+        """Generate formatted Excel from export-ready rows (iterable of dict), streaming row by row."""
+        # Same spooling as the PDF export: in memory while small, a temp file once it grows
+        with self._spooled_file() as output:
+            # constant_memory flushes each row as it is written instead of keeping the sheet in RAM
+            workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+            worksheet = workbook.add_worksheet('Low Attendance Report')
+
+            header_format = workbook.add_format(_HEADER_FMT)
+
+            rows = iter(data or [])
+            first_row = next(rows, None)
+            if first_row is not None:
+                columns = list(first_row.keys())
+
+                # Apply header styling
+                worksheet.write_row(0, 0, columns, header_format)
+
+                # itemgetter pulls a row's values in column order in one C call (a 1-tuple for one column)
+                get_values = operator.itemgetter(*columns) if len(columns) > 1 else (lambda row: (row[columns[0]],))
+                all_rows = enumerate(itertools.chain([first_row], rows), 1)
+
+                if set(columns) == _LOW_ATTENDANCE_WIDTHS.keys():
+                    # Known report shape: fixed widths, no per-cell measuring
+                    for i, col in enumerate(columns):
+                        worksheet.set_column(i, i, _LOW_ATTENDANCE_WIDTHS[col])
+                    for row_num, row in all_rows:
+                        worksheet.write_row(row_num, 0, get_values(row))
+                else:
+                    # Rows must be written in order; track the widest value per column on the way
+                    widths = [len(str(col)) for col in columns]
+                    for row_num, row in all_rows:
+                        values = get_values(row)
+                        worksheet.write_row(row_num, 0, values)
+                        widths = list(map(max, widths, map(len, map(str, values))))
+
+                    # Auto-fit columns
+                    for i, width in enumerate(widths):
+                        worksheet.set_column(i, i, width + 2)
+
+            workbook.close()
+        output.seek(0)
+
+        filename = self._export_filename(filter_info, "xlsx")
+        return self._file_response(output, filename, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
     def generate_pdf_export(self, records, filter_info=None, filename_prefix: str = "attendance"):
-        """Generate formatted PDF table for AttendanceRecord rows with wrapped cells and header-based column widths."""
-        output = io.BytesIO()
+        """Generate formatted PDF table for attendance rows (from get_filtered_attendance_rows) with wrapped cells and header-based column widths."""
+        # Small reports stay in memory; large ones spill to a temp file instead of growing a BytesIO
+        with self._spooled_file() as output:
+            self.build_pdf(output, records, filter_info)
+        output.seek(0)
+
+        filename = self._export_filename(filter_info, "pdf")
+        return self._file_response(output, filename, 'application/pdf', compress=True)
+
+    def generate_pdf_zip_export(self, jobs, filter_info=None):
+        """One PDF per (records, filter_info) job, bundled as a zip download."""
+        with self._spooled_file() as output:
+            # Stored, not deflated: the PDFs are compressed already
+            with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_STORED) as archive:
+                for records, job_filter_info in jobs:
+                    # Each PDF is written straight into its zip entry, no per-PDF bytes copy
+                    with archive.open(self._export_filename(job_filter_info, "pdf"), 'w') as entry:
+                        self.build_pdf(entry, records, job_filter_info)
+        output.seek(0)
+
+        filename = self._export_filename(filter_info, "zip")
+        return self._file_response(output, filename, 'application/zip')
+
+    def build_pdf(self, output, records, filter_info=None):
+        """Render the attendance report PDF into a binary file object."""
         # Tighter margins to maximize usable width while staying printable
         doc = SimpleDocTemplate(
             output,
@@ -76,26 +228,17 @@ class ExportUtils:
             rightMargin=24,
             topMargin=36,
             bottomMargin=36,
-        )
-
-        styles = getSampleStyleSheet()
-        title_style = ParagraphStyle(
-            'CustomTitle', parent=styles['Heading1'], fontSize=18, spaceAfter=7, alignment=1
-        )
-        filter_style = ParagraphStyle(
-            'FilterInfo', parent=styles['Normal'], fontSize=11, leading=11, wordWrap='CJK'
-        )
-        cell_style = ParagraphStyle(
-            'Cell', parent=styles['Normal'], fontSize=8, leading=10, wordWrap='LTR', alignment=1
+            # Deflated page streams (already reportlab's default; stated so the output does not depend on rl_config)
+            pageCompression=1,
         )
 
         content = []
-        content.append(Paragraph("Attendance Report", title_style))
+        content.append(Paragraph("Attendance Report", _TITLE_STYLE))
         content.append(Spacer(1, 8))
 
         if filter_info:
             filter_text = "Filters Applied: " + " | ".join(filter_info)
-            content.append(Paragraph(filter_text, filter_style))
+            content.append(Paragraph(escape(filter_text), _FILTER_STYLE))
             content.append(Spacer(1, 8))
 
         headers = [
@@ -103,28 +246,14 @@ class ExportUtils:
             'Attended', 'Total', 'Attendance %'
         ]
 
-        # Build table rows; wrap Student Name with Paragraph for proper wrapping
-        table_data = [headers]
-        for i, r in enumerate(records or [], 1):
-            table_data.append([
-                str(i),
-                str(r.course.course_code),
-                str(r.student.registration_no),
-                Paragraph(str(r.student.name or ''), cell_style),
-                str(r.attended_periods),
-                str(r.conducted_periods),
-                f"{r.attendance_percentage:.0f}",
-            ])
-
         # Compute column widths based on header text width + padding
         header_font = 'Helvetica-Bold'
         header_font_size = 10
         padding_lr = 12  # space on both sides
 
-        header_min_widths = []
-        for text in headers:
-            w = pdfmetrics.stringWidth(text, header_font, header_font_size)
-            header_min_widths.append(w + 2 * padding_lr)
+        header_min_widths = [
+            _string_width(text, header_font, header_font_size) + 2 * padding_lr for text in headers
+        ]
 
         available_width = doc.width
 
@@ -160,8 +289,28 @@ class ExportUtils:
                 can_shave = min(4, total_width - available_width)
                 col_widths[i] = max(header_min_widths[i] - can_shave, header_min_widths[i] - 4)
 
-        table = Table(table_data, colWidths=col_widths)
-        table_style = TableStyle([
+        # Build table rows in one pass. Names that fit the Student Name column are plain strings;
+        # only longer ones become a wrapping Paragraph (markup parse + layout per cell)
+        name_fit = col_widths[3] - 12  # Table's default 6pt left/right cell padding
+        cell_font, cell_font_size = _CELL_STYLE.fontName, _CELL_STYLE.fontSize
+
+        def name_cell(name):
+            name = str(name or '')
+            if pdfmetrics.stringWidth(name, cell_font, cell_font_size) <= name_fit:
+                return name
+            # Paragraph parses markup; escape so "&" and "<" print as they do in plain cells
+            return Paragraph(escape(name), _CELL_STYLE)
+
+        # Read each record's fields exactly once; table cells and row colors both use these tuples
+        rows = list(map(_PDF_FIELDS, records or []))
+        table_data = [headers] + [
+            [str(i), str(code), str(reg), name_cell(name), str(att), str(cond), _pct_str(pct)]
+            for i, (code, reg, name, att, cond, pct) in enumerate(rows, 1)
+        ]
+
+        # LongTable lays rows out in one pass for long reports; the header row repeats on every page
+        table = LongTable(table_data, colWidths=col_widths, repeatRows=1, splitByRow=True)
+        style_cmds = [
             ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
             ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
             ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
@@ -173,41 +322,30 @@ class ExportUtils:
             ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
             ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
             ('FONTSIZE', (0, 1), (-1, -1), 8),
+            ('LEADING', (0, 1), (-1, -1), 10),  # same line height as the wrapped-name Paragraphs
             ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ])
-
-        # Row highlighting like the original utility
-        for i, r in enumerate(records or [], 1):
-            row_index = i
-            if r.attendance_percentage < 65:
-                table_style.add('BACKGROUND', (0, row_index), (-1, row_index), colors.lightcoral)
-            elif r.attendance_percentage < 75:
-                table_style.add('BACKGROUND', (0, row_index), (-1, row_index), colors.lightyellow)
-            else:
-                table_style.add('BACKGROUND', (0, row_index), (-1, row_index), colors.lightgreen)
-
-        table.setStyle(table_style)
+        ]
+
+        # Row highlighting like the original utility: bucket every row at once (<65, <75, rest)
+        # and emit one BACKGROUND command per run of same-colored rows
+        run_colors = [colors.lightcoral, colors.lightyellow, colors.lightgreen]
+        pct = np.fromiter((row[5] for row in rows), dtype=float, count=len(rows))
+        buckets = np.digitize(pct, [65, 75])
+        run_starts = np.flatnonzero(np.diff(buckets)) + 1
+        style_cmds.extend(
+            ('BACKGROUND', (0, int(start) + 1), (-1, int(end)), run_colors[buckets[start]])
+            for start, end in zip(np.r_[0, run_starts], np.r_[run_starts, len(buckets)])
+            if start < end
+        )
+
+        # One TableStyle from the finished command list
+        table.setStyle(TableStyle(style_cmds))
         content.append(table)
         content.append(Spacer(1, 16))
         content.append(Paragraph(
-            f"Generated on: {datetime.now().strftime('%d-%m-%Y %H:%M:%S')} | Total Records: {len(records or [])}",
-            styles['Normal']
+            f"Generated on: {datetime.now().strftime('%d-%m-%Y %H:%M:%S')} | Total Records: {len(rows)}",
+            _STYLES['Normal']
         ))
         doc.title = "Attendance Report"
         doc.build(content)
-        output.seek(0)
 
-        # Build dynamic filename
-        if filter_info:
-            filter_str = " ".join(str(f).replace(":", "").replace(",", "").replace("|", "") for f in filter_info)
-            filename = f"{filter_str}.pdf"
-        else:
-            filename = "attendance.pdf"
-        
-        # Sanitize filename to prevent header issues
-        filename = filename.replace('"', '').replace("'", "")
-        
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'application/pdf'
-        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
-        return response
@@ -0,0 +1,14 @@
+"""
+Fast JSON responses built with orjson instead of Flask's jsonify
+"""
+import orjson
+from flask import Response
+
+
+def json_response(obj, status=200):
+    """Serialize obj with orjson and wrap it in an application/json Response"""
+    return Response(
+        orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY),
+        status=status,
+        mimetype='application/json'
+    )
@@ -63,11 +63,28 @@ export async function fetchCourses() {
 }
 
 export async function uploadFiles(files: File[]) {
-  const form = new FormData();
-  files.forEach(f => form.append('files', f));
-  const res = await fetch(`${API_BASE}/upload`, { method: 'POST', body: form });
-  if (!res.ok) throw new Error('Upload failed');
-  return res.text();
+  // One raw-body request per file (skips multipart parsing), sent one after another so
+  // files are saved in upload order and never race each other on the same records
+  const messages: string[] = [];
+  const failed: string[] = [];
+  for (const f of files) {
+    try {
+      const res = await fetch(`${API_BASE}/upload_stream?filename=${encodeURIComponent(f.name)}`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/octet-stream' },
+        body: f,
+      });
+      if (!res.ok) throw new Error(`Upload failed: ${f.name}`);
+      messages.push(await res.text());
+    } catch {
+      failed.push(f.name);
+    }
+  }
+  // Any failed file is reported, even when the others were saved
+  if (failed.length > 0) {
+    throw new Error(`${failed.length} of ${files.length} file(s) failed: ${failed.join(', ')}`);
+  }
+  return messages.join('\n');
 }
 
 export async function deleteRecord(id: number) {
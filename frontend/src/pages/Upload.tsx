@@ -94,7 +94,8 @@ export default function Upload() {
         window.location.href = '/';
       }, 2000);
     } catch (e) {
-      setMessage({ type: 'error', text: 'Upload failed. Please check file format and try again.' });
+      const detail = e instanceof Error && e.message ? ` ${e.message}.` : '';
+      setMessage({ type: 'error', text: `Upload failed.${detail} Please check file format and try again.` });
     } finally {
       setSubmitting(false);
     }
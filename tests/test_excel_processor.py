@@ -0,0 +1,57 @@
+"""
+Regression tests for ExcelProcessor parsing and saving
+"""
+import io
+import os
+import tempfile
+import unittest
+
+# The app reads DATABASE_URL at import time, so point it at a throwaway SQLite file first
+_db_fd, _db_path = tempfile.mkstemp(suffix='.db')
+os.close(_db_fd)
+os.environ['DATABASE_URL'] = f'sqlite:///{_db_path}'
+
+import openpyxl
+
+from app import app, excel_processor
+from backend.models import db, Student, AttendanceRecord
+
+
+def make_workbook(rows):
+    """XLSX bytes for the given sheet rows"""
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    for row in rows:
+        sheet.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+class SaveWithoutCoursesTest(unittest.TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        with app.app_context():
+            db.engine.dispose()
+        os.remove(_db_path)
+
+    def test_students_without_course_columns_are_saved(self):
+        """A sheet with student columns but no course columns saves its students and no records"""
+        rows = [
+            ['Attendance Report'], [], [], [], [], [None, None, None],
+            ['ADMISSION NO', 'REGISTRATION NO', 'STUDENT NAME'],
+        ] + [[f'A{i}', f'22IT{i:03d}', f'Student {i}'] for i in range(5)]
+
+        processed = excel_processor.process_excel_file_from_memory('students.xlsx', make_workbook(rows))
+        self.assertIsNotNone(processed)
+        self.assertEqual(len(processed['attendance']), 0)
+
+        with app.app_context():
+            self.assertTrue(excel_processor.save_to_database(processed))
+            self.assertEqual(Student.query.count(), 5)
+            self.assertEqual(AttendanceRecord.query.count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()